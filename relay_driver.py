@@ -8,26 +8,40 @@ Protocol:
 - 50ms delay required between commands
 """
 
-import subprocess
-import sys
+import os
 import time
 from typing import Optional, List
 
-# Auto-install missing modules
-try:
-    import serial
-    import serial.tools.list_ports
-except ModuleNotFoundError as e:
-    print(f"Missing module: {e.name}")
-    print(f"Installing {e.name}...")
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "pyserial"])
-    import serial
-    import serial.tools.list_ports
-    print("Installation complete!")
+import serial
+import serial.tools.list_ports
+
+
+# Cached result of the most recent port enumeration. comports() does a
+# full registry/udev device scan (50-200ms on Windows), so connect
+# retries and error dialogs reuse a recent scan instead of repeating it.
+_PORT_CACHE_TTL = 2.0
+_port_cache = (0.0, [])
+
+
+def _cached_comports():
+    """Enumerate COM ports, reusing a scan newer than _PORT_CACHE_TTL"""
+    global _port_cache
+    now = time.monotonic()
+    if now - _port_cache[0] < _PORT_CACHE_TTL:
+        return _port_cache[1]
+    ports = list(serial.tools.list_ports.comports())
+    _port_cache = (now, ports)
+    return ports
 
 
 class RelayDriver:
-    """Driver for CH340 USB 4-channel relay board"""
+    """
+    Driver for CH340 USB 4-channel relay board
+
+    Use as a context manager (``with RelayDriver() as relay:``) or call
+    disconnect() explicitly when done; the port is not closed implicitly
+    on garbage collection.
+    """
     
     # Protocol constants
     START_FLAG = 0xA0
@@ -36,25 +50,52 @@ class RelayDriver:
     STATUS_QUERY = 0xFF
     BAUD_RATE = 9600
     COMMAND_DELAY = 0.05  # 50ms delay between commands
+    CH340_VID = 0x1A86  # WCH vendor ID used by CH340/CH341 chips
+
+    # Precomputed frames for the full (relay, state) command space. The
+    # protocol is static (8 relays x 2 states), so each 4-byte frame is
+    # encoded once at class creation instead of per call.
+    # (0xA0 is START_FLAG; class-level names are not visible inside a
+    # class-body comprehension.)
+    _CMD_TABLE = {
+        (n, s): bytes([0xA0, n, s, (0xA0 + n + s) & 0xFF])
+        for n in range(1, 9) for s in (0x00, 0x01)
+    }
     
-    def __init__(self, port: Optional[str] = None, auto_connect: bool = True):
+    def __init__(self, port: Optional[str] = None, auto_connect: bool = True,
+                 fast_batch: bool = True, settle_delay: float = 0.1):
         """
         Initialize relay driver
-        
+
         Args:
             port: COM port name (e.g., 'COM3'). If None, will auto-detect CH340
             auto_connect: Automatically connect on initialization
+            fast_batch: Send all_on/all_off as a single multi-frame write.
+                Most CH340 relay firmwares parse back-to-back frames fine;
+                set False if your board needs the 50ms gap between frames
+            settle_delay: Seconds to wait after opening the port, for
+                firmware that resets on open. Set 0 to connect immediately
         """
         self.port = port
+        self.settle_delay = settle_delay
         self.serial_conn: Optional[serial.Serial] = None
-        self.last_command_time = 0
-        
+        self._next_send_ns = 0  # Monotonic deadline for the next allowed write
+        self.fast_batch = fast_batch
+        # Last state commanded per relay (1-indexed); None = unknown
+        self._last_state: List[Optional[bool]] = [None] * 9
+
         if auto_connect:
             self.connect()
     
     def _find_ch340_port(self) -> Optional[str]:
         """Auto-detect CH340 USB-SERIAL device"""
-        ports = serial.tools.list_ports.comports()
+        ports = _cached_comports()
+        # Match on the USB vendor ID first -- it is authoritative, unlike
+        # description strings which vary by OS and driver version
+        for port in ports:
+            if getattr(port, 'vid', None) == self.CH340_VID:
+                return port.device
+        # Fall back to the description heuristic for ports that report no VID
         for port in ports:
             # CH340 typically shows up with these identifiers
             if 'CH340' in port.description.upper() or 'USB-SERIAL' in port.description.upper():
@@ -78,13 +119,40 @@ class RelayDriver:
                 raise ConnectionError("Could not find CH340 device. Please specify port manually.")
         
         try:
+            # Hardware handshaking is disabled explicitly: leaving RTS/DTR
+            # to the OS default can reset the CH340 (100-500ms glitch) on
+            # open. exclusive keeps a second process from grabbing the port
             self.serial_conn = serial.Serial(
                 port=self.port,
                 baudrate=self.BAUD_RATE,
                 timeout=1,
-                write_timeout=1
+                write_timeout=0.1,
+                rtscts=False,
+                dsrdtr=False,
+                exclusive=True
             )
-            time.sleep(0.1)  # Allow connection to stabilize
+            # Ask the kernel to minimize USB-serial buffering (~16ms by
+            # default on Linux). Not all chips/drivers support this --
+            # notably the CH341 kernel driver may ignore it -- so degrade
+            # gracefully on failure.
+            try:
+                self.serial_conn.set_low_latency_mode(True)
+            except (OSError, AttributeError, NotImplementedError, ValueError):
+                pass
+            # The ioctl above is a no-op with some USB-serial kernel
+            # drivers; on Linux the sysfs latency_timer attribute is the
+            # reliable knob when the driver exposes one
+            try:
+                timer_path = (f"/sys/bus/usb-serial/devices/"
+                              f"{os.path.basename(self.port)}/latency_timer")
+                with open(timer_path, 'w') as f:
+                    f.write("1")
+            except OSError:
+                pass
+            # Relay states are unknown on a fresh connection
+            self._last_state = [None] * 9
+            if self.settle_delay > 0:
+                time.sleep(self.settle_delay)  # Allow connection to stabilize
             return True
         except serial.SerialException as e:
             raise ConnectionError(f"Failed to connect to {self.port}: {e}")
@@ -94,6 +162,7 @@ class RelayDriver:
         if self.serial_conn and self.serial_conn.is_open:
             self.serial_conn.close()
             self.serial_conn = None
+        self._last_state = [None] * 9
     
     def _calculate_checksum(self, relay_num: int, state: int) -> int:
         """
@@ -101,6 +170,10 @@ class RelayDriver:
         Checksum = START_FLAG + RELAY_NUM + STATE
         """
         return (self.START_FLAG + relay_num + state) & 0xFF
+
+    def _build_cmd(self, relay_num: int, state: int) -> bytes:
+        """Return the precomputed 4-byte command frame for one relay"""
+        return self._CMD_TABLE[(relay_num, state)]
     
     def _send_command(self, command: bytes):
         """
@@ -112,14 +185,19 @@ class RelayDriver:
         if not self.serial_conn or not self.serial_conn.is_open:
             raise ConnectionError("Not connected to relay board")
         
-        # Enforce 50ms delay between commands
-        elapsed = time.time() - self.last_command_time
-        if elapsed < self.COMMAND_DELAY:
-            time.sleep(self.COMMAND_DELAY - elapsed)
-        
+        # Enforce 50ms delay between commands. Tracked as an absolute
+        # monotonic deadline: one integer compare on the hot path, and
+        # immune to wall-clock jumps that could produce negative sleeps
+        wait_ns = self._next_send_ns - time.monotonic_ns()
+        if wait_ns > 0:
+            time.sleep(wait_ns / 1e9)
+
+        # Fire-and-forget: no flush() here. Draining the OS write buffer
+        # costs a kernel round-trip per command, and the inter-command
+        # delay already guarantees the 4-byte frame is long gone at 9600
+        # baud before the next write
         self.serial_conn.write(command)
-        self.serial_conn.flush()
-        self.last_command_time = time.time()
+        self._next_send_ns = time.monotonic_ns() + int(self.COMMAND_DELAY * 1e9)
     
     def set_relay(self, relay_num: int, state: bool):
         """
@@ -131,12 +209,16 @@ class RelayDriver:
         """
         if not 1 <= relay_num <= 8:
             raise ValueError(f"Relay number must be 1-8, got {relay_num}")
-        
+
+        # Skip the write (and its 50ms pacing) if the relay is already in
+        # the requested state
+        state = bool(state)
+        if self._last_state[relay_num] == state:
+            return
+
         state_byte = self.STATE_ON if state else self.STATE_OFF
-        checksum = self._calculate_checksum(relay_num, state_byte)
-        
-        command = bytes([self.START_FLAG, relay_num, state_byte, checksum])
-        self._send_command(command)
+        self._send_command(self._CMD_TABLE[(relay_num, state_byte)])
+        self._last_state[relay_num] = state
     
     def relay_on(self, relay_num: int):
         """Turn on specified relay (1-8)"""
@@ -146,16 +228,73 @@ class RelayDriver:
         """Turn off specified relay (1-8)"""
         self.set_relay(relay_num, False)
     
+    def set_mask(self, mask: int):
+        """
+        Set all 8 relays to match a bitmask in one pipelined write
+
+        Bit (n-1) of mask controls relay n. The protocol has no native
+        mask command, so this composes one frame per relay whose tracked
+        state differs from the mask and submits them as a single batch.
+
+        Args:
+            mask: 8-bit relay state mask (bit set = ON)
+        """
+        if not 0 <= mask <= 0xFF:
+            raise ValueError(f"Mask must be 0-255, got {mask}")
+
+        frames = []
+        changed = []
+        for n in range(1, 9):
+            state = bool(mask & (1 << (n - 1)))
+            if self._last_state[n] == state:
+                continue
+            frames.append(self._CMD_TABLE[(n, int(state))])
+            changed.append((n, state))
+
+        if not frames:
+            return
+        self._send_command(b"".join(frames))
+        for n, state in changed:
+            self._last_state[n] = state
+
     def all_on(self):
         """Turn on all relays (1-8)"""
-        for i in range(1, 9):
-            self.relay_on(i)
-    
+        if self.fast_batch:
+            frames = b"".join(self._build_cmd(i, self.STATE_ON) for i in range(1, 9))
+            self._send_command(frames)
+            self._last_state[1:] = [True] * 8
+        else:
+            for i in range(1, 9):
+                self.relay_on(i)
+
     def all_off(self):
         """Turn off all relays (1-8)"""
-        for i in range(1, 9):
-            self.relay_off(i)
+        if self.fast_batch:
+            frames = b"".join(self._build_cmd(i, self.STATE_OFF) for i in range(1, 9))
+            self._send_command(frames)
+            self._last_state[1:] = [False] * 8
+        else:
+            for i in range(1, 9):
+                self.relay_off(i)
     
+    def write_raw(self, payload: bytes):
+        """
+        Write pre-built command frames directly, bypassing per-command
+        pacing and redundant-write tracking
+
+        Intended for callers that batch frames themselves (e.g. timing
+        tests). Relay states are treated as unknown afterwards.
+
+        Args:
+            payload: One or more concatenated 4-byte command frames
+        """
+        if not self.serial_conn or not self.serial_conn.is_open:
+            raise ConnectionError("Not connected to relay board")
+
+        self.serial_conn.write(payload)
+        self._next_send_ns = time.monotonic_ns() + int(self.COMMAND_DELAY * 1e9)
+        self._last_state = [None] * 9
+
     def query_status(self) -> Optional[bytes]:
         """
         Query relay status
@@ -174,9 +313,11 @@ class RelayDriver:
         # Clear input buffer
         self.serial_conn.reset_input_buffer()
         
-        # Send status query
+        # Send status query; flush here so the query is on the wire before
+        # we start the response wait (the only request/response exchange)
         self._send_command(bytes([self.STATUS_QUERY]))
-        
+        self.serial_conn.flush()
+
         # Wait for response
         time.sleep(0.1)
         if self.serial_conn.in_waiting > 0:
@@ -191,13 +332,8 @@ class RelayDriver:
     def __exit__(self, exc_type, exc_val, exc_tb):
         """Context manager exit"""
         self.disconnect()
-    
-    def __del__(self):
-        """Cleanup on deletion"""
-        self.disconnect()
 
 
 def list_available_ports() -> List[str]:
     """List all available COM ports"""
-    ports = serial.tools.list_ports.comports()
-    return [f"{port.device}: {port.description}" for port in ports]
+    return [f"{port.device}: {port.description}" for port in _cached_comports()]
@@ -3,18 +3,27 @@ Manual Relay Control GUI
 Simple interface to control relays 1-4 individually
 """
 
-import subprocess
-import sys
 import tkinter as tk
 from tkinter import messagebox, ttk
+from functools import partial
 import threading
+import queue
 import json
 from pathlib import Path
 
-# Auto-install missing modules (pyserial is imported via relay_driver)
-# The relay_driver module will handle installing pyserial if needed
+# orjson parses/serializes several times faster than stdlib json; fall
+# back to json when it isn't installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from relay_driver import RelayDriver, list_available_ports
 
+# Relay count per board type -- single source of truth for every place
+# that needs to translate the config's relay_board_type setting
+BOARD_SIZES = {'4-relay': 4, '8-relay': 8}
+
 
 class ConfigurationWindow:
     """Configuration window for relay settings"""
@@ -90,7 +99,7 @@ class ConfigurationWindow:
     
     def on_board_type_changed(self, event=None):
         """Handle relay board type change"""
-        relay_count = 4 if self.board_type_var.get() == '4-relay' else 8
+        relay_count = BOARD_SIZES[self.board_type_var.get()]
         
         for i in range(1, 9):
             if i <= relay_count:
@@ -104,7 +113,7 @@ class ConfigurationWindow:
     def check_relay_state_compatibility(self):
         """Check if switching board type is safe given current relay states"""
         new_board_type = self.board_type_var.get()
-        new_relay_count = 4 if new_board_type == '4-relay' else 8
+        new_relay_count = BOARD_SIZES[new_board_type]
         
         # If switching to 4-relay, check if any relays 5-8 are on
         if new_relay_count == 4:
@@ -121,7 +130,7 @@ class ConfigurationWindow:
                     for relay_num in range(5, 9):
                         try:
                             self.parent_gui.relay_driver.relay_off(relay_num)
-                            self.parent_gui.relay_states[relay_num] = False
+                            self.parent_gui._set_relay_state(relay_num, False)
                         except:
                             pass
                     return True
@@ -146,7 +155,7 @@ class ConfigurationWindow:
             self.config['hardware']['relay_board_type'] = new_board_type
             
             # Determine relay count for new board type
-            new_relay_count = 4 if new_board_type == '4-relay' else 8
+            new_relay_count = BOARD_SIZES[new_board_type]
             
             # Only save relay names for relays within the current board type
             # Don't overwrite names for relays beyond the current board type
@@ -158,8 +167,12 @@ class ConfigurationWindow:
                 # (don't save "Unused" over them)
             
             # Save to file
-            with open('config.json', 'w') as f:
-                json.dump(self.config, f, indent=2)
+            if orjson is not None:
+                Path('config.json').write_bytes(
+                    orjson.dumps(self.config, option=orjson.OPT_INDENT_2))
+            else:
+                with open('config.json', 'w') as f:
+                    json.dump(self.config, f, indent=2)
             
             messagebox.showinfo("Success", "Configuration saved successfully!")
             
@@ -184,24 +197,49 @@ class RelayManualControlGUI:
         self.config = self.load_config()
         
         # Determine relay count from config
-        self.relay_count = 4 if self.config['hardware']['relay_board_type'] == '4-relay' else 8
+        self.relay_count = BOARD_SIZES[self.config['hardware']['relay_board_type']]
         
         # Set window size based on relay count
         height = 250 + (self.relay_count * 35)
         self.root.geometry(f"500x{height}")
         
         self.relay_driver = None
-        self.relay_states = {i: False for i in range(1, self.relay_count + 1)}
-        
+        # Relay states packed into a bitmask: bit (n-1) set means relay n is ON
+        self._state_mask = 0
+
+        # Serial commands run on a background worker thread so the 50ms
+        # per-command delay never blocks the Tk mainloop
+        self._command_queue = queue.Queue()
+        self._worker_thread = threading.Thread(target=self._command_worker, daemon=True)
+        self._worker_thread.start()
+
         self._setup_ui()
         self._connect_relay()
     
+    @property
+    def relay_states(self):
+        """Relay states materialized as a {relay_num: bool} dict"""
+        return {i: bool(self._state_mask & (1 << (i - 1)))
+                for i in range(1, self.relay_count + 1)}
+
+    def _relay_is_on(self, relay_num: int) -> bool:
+        """Check a single relay's tracked state"""
+        return bool(self._state_mask & (1 << (relay_num - 1)))
+
+    def _set_relay_state(self, relay_num: int, state: bool):
+        """Update a single relay's tracked state"""
+        bit = 1 << (relay_num - 1)
+        if state:
+            self._state_mask |= bit
+        else:
+            self._state_mask &= ~bit
+
     def load_config(self):
         """Load configuration from JSON file"""
         config_path = Path("config.json")
         if config_path.exists():
-            with open(config_path, 'r') as f:
-                return json.load(f)
+            data = config_path.read_bytes()
+            return orjson.loads(data) if orjson is not None else json.loads(data)
         else:
             # Default config if file doesn't exist
             return {
@@ -266,22 +304,27 @@ class RelayManualControlGUI:
         )
         
         # Create relay controls
+        self.name_vars = {}
+        self.name_labels = {}
         self.state_labels = {}
         self.on_buttons = {}
         self.off_buttons = {}
-        
+
         for relay_num in range(1, self.relay_count + 1):
             row = relay_num + 3
-            
+
             # Get relay name from config
             relay_name = self.config['hardware'].get(f'relay{relay_num}_function', f'Relay {relay_num}')
-            
-            # Relay label with name
-            ttk.Label(
+
+            # Relay label with name, backed by a StringVar so renames from
+            # the configuration window update in place without widget rebuilds
+            self.name_vars[relay_num] = tk.StringVar(value=relay_name)
+            self.name_labels[relay_num] = ttk.Label(
                 main_frame,
-                text=f"{relay_name}",
+                textvariable=self.name_vars[relay_num],
                 font=("Arial", 10)
-            ).grid(row=row, column=0, padx=5, pady=3, sticky=tk.W)
+            )
+            self.name_labels[relay_num].grid(row=row, column=0, padx=5, pady=3, sticky=tk.W)
             
             # State indicator
             self.state_labels[relay_num] = tk.Label(
@@ -298,7 +341,7 @@ class RelayManualControlGUI:
                 main_frame,
                 text="ON",
                 width=8,
-                command=lambda r=relay_num: self._turn_on_relay(r)
+                command=partial(self._turn_on_relay, relay_num)
             )
             self.on_buttons[relay_num].grid(row=row, column=2, padx=2, pady=3)
             
@@ -307,7 +350,7 @@ class RelayManualControlGUI:
                 main_frame,
                 text="OFF",
                 width=8,
-                command=lambda r=relay_num: self._turn_off_relay(r)
+                command=partial(self._turn_off_relay, relay_num)
             )
             self.off_buttons[relay_num].grid(row=row, column=3, padx=2, pady=3)
         
@@ -349,50 +392,100 @@ class RelayManualControlGUI:
     def refresh_gui(self):
         """Refresh GUI with new configuration"""
         # Check if relay count changed
-        new_relay_count = 4 if self.config['hardware']['relay_board_type'] == '4-relay' else 8
+        new_relay_count = BOARD_SIZES[self.config['hardware']['relay_board_type']]
         
         if new_relay_count != self.relay_count:
             # Relay count changed, need to rebuild UI
-            # Preserve relay states for relays that will still exist
-            old_relay_states = self.relay_states.copy()
             self.relay_count = new_relay_count
-            
+
             # Disconnect from relay board if connected
             if self.relay_driver:
                 try:
                     self.relay_driver.disconnect()
                 except:
                     pass
-            
+
             # Clear old widgets
             for widget in self.root.winfo_children():
                 widget.destroy()
-            
-            # Rebuild UI with preserved states
-            self.relay_states = {}
-            for i in range(1, self.relay_count + 1):
-                # Preserve state if it existed before, otherwise default to False
-                self.relay_states[i] = old_relay_states.get(i, False)
-            
+
+            # Drop tracked states for relays beyond the new board size;
+            # states for relays that still exist are preserved in the mask
+            self._state_mask &= (1 << self.relay_count) - 1
+
             self._setup_ui()
             self._connect_relay()
             
             # Update relay state indicators to show current states
             self._update_relay_indicators()
         else:
-            # Only relay names changed, update labels
+            # Only relay names changed, update the label variables in place
             for relay_num in range(1, self.relay_count + 1):
                 relay_name = self.config['hardware'].get(f'relay{relay_num}_function', f'Relay {relay_num}')
-                # Find and update the label widget for this relay
-                # The label is in the main frame at row (relay_num + 3), column 0
-                main_frame = self.root.winfo_children()[0]
-                label_widget = main_frame.grid_slaves(row=relay_num + 3, column=0)[0]
-                label_widget.config(text=relay_name)
+                self.name_vars[relay_num].set(relay_name)
     
+    def _command_worker(self):
+        """Background thread: execute queued relay commands off the Tk thread"""
+        stop = False
+        while not stop:
+            jobs = [self._command_queue.get()]
+            # Drain whatever queued up while the previous command was paced
+            while True:
+                try:
+                    jobs.append(self._command_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in jobs:
+                stop = True
+                jobs = jobs[:jobs.index(None)]
+
+            # Coalesce rapid toggles: for jobs sharing a key (one key per
+            # relay), only the most recent requested state matters, so
+            # superseded commands are dropped without touching the board
+            seen_keys = set()
+            batch = []
+            for job in reversed(jobs):
+                key = job[0]
+                if key is not None:
+                    if key in seen_keys:
+                        continue
+                    seen_keys.add(key)
+                batch.append(job)
+
+            for key, command, on_done, on_error in reversed(batch):
+                try:
+                    command()
+                except Exception as e:
+                    self.root.after(0, on_error, e)
+                else:
+                    if on_done:
+                        self.root.after(0, on_done)
+
+    def _submit_command(self, command, on_done=None, on_error=None, coalesce_key=None):
+        """
+        Queue a relay command for the worker thread
+
+        Args:
+            command: Callable performing the serial operation
+            on_done: Callback run on the Tk thread after success
+            on_error: Callback run on the Tk thread with the exception on failure
+            coalesce_key: Commands queued with the same key are superseded
+                by the newest one (e.g. per-relay toggles); None disables
+                coalescing for this command
+        """
+        if on_error is None:
+            on_error = lambda e: messagebox.showerror("Error", f"Relay command failed:\n{str(e)}")
+        self._command_queue.put((coalesce_key, command, on_done, on_error))
+
+    def _stop_command_worker(self):
+        """Signal the worker thread to exit and wait briefly for it"""
+        self._command_queue.put(None)
+        self._worker_thread.join(timeout=2)
+
     def _update_relay_indicators(self):
         """Update relay state indicators to show current on/off status"""
         for relay_num in range(1, self.relay_count + 1):
-            if self.relay_states.get(relay_num, False):
+            if self._relay_is_on(relay_num):
                 self.state_labels[relay_num].config(text="ON", fg="green")
             else:
                 self.state_labels[relay_num].config(text="OFF", fg="red")
@@ -425,12 +518,17 @@ class RelayManualControlGUI:
             messagebox.showerror("Error", "Not connected to relay board")
             return
         
-        try:
-            self.relay_driver.relay_on(relay_num)
-            self.relay_states[relay_num] = True
+        def on_done():
+            self._set_relay_state(relay_num, True)
             self.state_labels[relay_num].config(text="ON", fg="green")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to turn on relay {relay_num}:\n{str(e)}")
+
+        self._submit_command(
+            lambda: self.relay_driver.relay_on(relay_num),
+            on_done=on_done,
+            on_error=lambda e: messagebox.showerror(
+                "Error", f"Failed to turn on relay {relay_num}:\n{str(e)}"),
+            coalesce_key=relay_num
+        )
     
     def _turn_off_relay(self, relay_num: int):
         """Turn off specified relay"""
@@ -438,12 +536,17 @@ class RelayManualControlGUI:
             messagebox.showerror("Error", "Not connected to relay board")
             return
         
-        try:
-            self.relay_driver.relay_off(relay_num)
-            self.relay_states[relay_num] = False
+        def on_done():
+            self._set_relay_state(relay_num, False)
             self.state_labels[relay_num].config(text="OFF", fg="red")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to turn off relay {relay_num}:\n{str(e)}")
+
+        self._submit_command(
+            lambda: self.relay_driver.relay_off(relay_num),
+            on_done=on_done,
+            on_error=lambda e: messagebox.showerror(
+                "Error", f"Failed to turn off relay {relay_num}:\n{str(e)}"),
+            coalesce_key=relay_num
+        )
     
     def _all_off(self):
         """Turn off all relays"""
@@ -451,17 +554,21 @@ class RelayManualControlGUI:
             messagebox.showerror("Error", "Not connected to relay board")
             return
         
-        try:
-            # Turn off each relay individually to ensure all are off
+        def on_done():
+            self._state_mask = 0
             for relay_num in range(1, self.relay_count + 1):
-                self.relay_driver.relay_off(relay_num)
-                self.relay_states[relay_num] = False
                 self.state_labels[relay_num].config(text="OFF", fg="red")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to turn off relays:\n{str(e)}")
+
+        self._submit_command(
+            self.relay_driver.all_off,
+            on_done=on_done,
+            on_error=lambda e: messagebox.showerror(
+                "Error", f"Failed to turn off relays:\n{str(e)}")
+        )
     
     def _on_closing(self):
         """Handle window closing"""
+        self._stop_command_worker()
         if self.relay_driver:
             try:
                 # Safety: Turn off all relays before closing